@@ -0,0 +1,94 @@
+"""
+Benchmark phần đọc payload + cộng theo ngày của /forecast (không gồm Prophet).
+
+So sánh đường cũ (json → DataFrame → to_datetime → groupby → reindex) với
+transactions.py (orjson / CSV, epoch-day + np.bincount) từ 1k đến 1M giao dịch.
+
+    python bench_forecast.py            # 1k, 10k, 100k, 1M
+    python bench_forecast.py 1000 50000 # kích thước tùy chọn
+"""
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from transactions import daily_totals, parse_transactions, to_amounts, to_epoch_days
+
+SIZES = (1_000, 10_000, 100_000, 1_000_000)
+HISTORY_DAYS = 5 * 365
+
+
+def make_payloads(n, seed=0):
+    rng = np.random.default_rng(seed)
+    start = np.datetime64("2021-01-01")
+    dates = (start + rng.integers(0, HISTORY_DAYS, n)).astype(str).tolist()
+    amounts = (rng.integers(1, 500, n) * 1000).tolist()
+
+    rows = json.dumps([{"date": d, "amount": a} for d, a in zip(dates, amounts)]).encode()
+    columns = json.dumps({"date": dates, "amount": amounts}).encode()
+    csv = ("date,amount\n" + "\n".join(f"{d},{a}" for d, a in zip(dates, amounts))).encode()
+    return {"json rows": rows, "json columns": columns, "csv": csv}
+
+
+def legacy(body):
+    t0 = time.perf_counter()
+    df = pd.DataFrame(json.loads(body))
+    df["ds"] = pd.to_datetime(df["date"], errors="coerce")
+    df = df.dropna(subset=["ds"])
+    df["y"] = pd.to_numeric(df["amount"], errors="coerce").fillna(0)
+    t1 = time.perf_counter()
+
+    df_daily = df.groupby("ds")["y"].sum().reset_index()
+    full_range = pd.date_range(start=df_daily["ds"].min(), end=df_daily["ds"].max())
+    df_daily.set_index("ds").reindex(full_range, fill_value=0).reset_index()
+    t2 = time.perf_counter()
+    return t1 - t0, t2 - t1
+
+
+def columnar(body, content_type):
+    t0 = time.perf_counter()
+    dates, amounts = parse_transactions(body, content_type)
+    days, valid = to_epoch_days(dates)
+    days = days[valid]
+    y = to_amounts(amounts)[valid]
+    t1 = time.perf_counter()
+
+    daily_totals(days, y, int(days.min()), int(days.max()))
+    t2 = time.perf_counter()
+    return t1 - t0, t2 - t1
+
+
+def best_of(fn, repeat):
+    return min((fn() for _ in range(repeat)), key=sum)
+
+
+def main(sizes):
+    rows = []
+    for n in sizes:
+        payloads = make_payloads(n)
+        repeat = 3 if n <= 100_000 else 1
+        cases = [
+            ("legacy (json rows)", payloads["json rows"], lambda b: legacy(b)),
+            ("json rows", payloads["json rows"], lambda b: columnar(b, "application/json")),
+            ("json columns", payloads["json columns"], lambda b: columnar(b, "application/json")),
+            ("csv", payloads["csv"], lambda b: columnar(b, "text/csv")),
+        ]
+        for name, body, fn in cases:
+            parse_s, agg_s = best_of(lambda: fn(body), repeat)
+            rows.append({
+                "transactions": n,
+                "format": name,
+                "payload_kb": round(len(body) / 1024),
+                "parse_ms": round(parse_s * 1000, 1),
+                "aggregate_ms": round(agg_s * 1000, 2),
+                "total_ms": round((parse_s + agg_s) * 1000, 1),
+            })
+        print(f"✅ {n} transactions done", file=sys.stderr)
+
+    print(pd.DataFrame(rows).to_markdown(index=False))
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or SIZES)
@@ -0,0 +1,285 @@
+"""
+Kho đặc trưng (feature store) dựng sẵn cho các mô hình dự báo.
+
+Mỗi ngày trong cửa sổ FEATURE_YEARS có sẵn:
+- bảng ngày lễ Việt Nam (gồm Tết âm lịch) dạng sự kiện (ds, holiday)
+- ma trận chỉ báo ngày lễ (ngày × tên ngày lễ)
+- các cột Fourier cho mùa vụ tuần / năm, tính y hệt Prophet.fourier_series
+
+Tất cả được tính một lần (trong master khi preload), ghi ra file .npy trong
+SHARED_STATE_DIR và mở bằng mmap → các worker dùng chung, mỗi request chỉ
+cắt (slice) theo epoch-day. CachedProphet lấy cột mùa vụ từ kho này; mô hình
+khác có thể gọi trực tiếp seasonality_features / holiday_features.
+"""
+import os
+from datetime import datetime
+
+import holidays as holidays_lib
+import numpy as np
+import pandas as pd
+from prophet import Prophet
+from prophet.make_holidays import make_holidays_df
+
+# ✅ Trạng thái chỉ-đọc dùng chung giữa các worker (file .npy mở bằng mmap)
+SHARED_STATE_DIR = os.environ.get("SHARED_STATE_DIR", "/tmp/ocr-shared")
+
+# Đổi số này khi thay đổi cách tính để các file cũ được dựng lại
+FEATURE_VERSION = 1
+FEATURE_YEARS = range(2015, datetime.now().year + 3)
+
+# (period, fourier_order) mặc định của Prophet cho mùa vụ tuần và năm
+SEASONALITIES = {
+    "weekly": (7, 3),
+    "yearly": (365.25, 10),
+}
+
+NS_PER_DAY = 24 * 60 * 60 * 10**9
+
+# Đánh dấu DataFrame do vn_holidays() trả về: (năm đầu, năm cuối)
+VN_HOLIDAY_YEARS_ATTR = "vn_holiday_years"
+
+# Tắt bởi _self_check() nếu CachedProphet không còn khớp Prophet gốc (vd. sau khi nâng cấp prophet)
+CACHE_ENABLED = True
+
+
+def load_shared_arrays(name, keys, build):
+    """
+    Trả về dict {key: mảng numpy read-only, mmap từ SHARED_STATE_DIR}.
+
+    Nếu file chưa có thì gọi build() (trả về dict mảng) và ghi ra đĩa một lần.
+    Các worker mở cùng file nên dùng chung page cache thay vì mỗi worker
+    giữ một bản sao riêng.
+    """
+    paths = {key: os.path.join(SHARED_STATE_DIR, f"{name}_{key}.npy") for key in keys}
+
+    if not all(os.path.exists(p) for p in paths.values()):
+        os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+        arrays = build()
+        for key, path in paths.items():
+            # Ghi file tạm rồi đổi tên để process khác không đọc phải file dở dang
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as fh:
+                np.save(fh, arrays[key])
+            os.replace(tmp_path, path)
+
+    return {key: np.load(path, mmap_mode="r") for key, path in paths.items()}
+
+
+def _epoch_day(year, month, day):
+    return int(np.datetime64(f"{year:04d}-{month:02d}-{day:02d}", "D").astype(np.int64))
+
+
+FIRST_DAY = _epoch_day(FEATURE_YEARS.start, 1, 1)
+LAST_DAY = _epoch_day(FEATURE_YEARS.stop - 1, 12, 31)
+
+
+def fourier_columns(t, period, series_order):
+    """Giống hệt Prophet.fourier_series với t = số ngày kể từ epoch (float)."""
+    x_T = np.pi * 2 * t
+    fourier_components = np.empty((t.shape[0], 2 * series_order))
+    for i in range(series_order):
+        c = (i + 1) / period * x_T
+        fourier_components[:, 2 * i] = np.sin(c)
+        fourier_components[:, (2 * i) + 1] = np.cos(c)
+    return fourier_components
+
+
+def _build_features():
+    events = make_holidays_df(year_list=list(FEATURE_YEARS), country="VN").sort_values("ds")
+    event_days = events["ds"].to_numpy(dtype="datetime64[D]")
+    event_names = events["holiday"].to_numpy(dtype=str)
+
+    names, name_idx = np.unique(event_names, return_inverse=True)
+    indicator = np.zeros((LAST_DAY - FIRST_DAY + 1, len(names)), dtype=np.uint8)
+    indicator[event_days.astype(np.int64) - FIRST_DAY, name_idx] = 1
+
+    t = np.arange(FIRST_DAY, LAST_DAY + 1, dtype=np.float64)
+    arrays = {
+        "holiday_ds": event_days,
+        "holiday_name": event_names,
+        "holiday_columns": names,
+        "holiday_indicator": indicator,
+    }
+    for key, (period, order) in SEASONALITIES.items():
+        arrays[key] = fourier_columns(t, period, order)
+    return arrays
+
+
+STORE = load_shared_arrays(
+    f"vn_features_v{FEATURE_VERSION}_{FEATURE_YEARS.start}_{FEATURE_YEARS.stop - 1}"
+    f"_holidays{holidays_lib.__version__}",
+    ("holiday_ds", "holiday_name", "holiday_columns", "holiday_indicator", *SEASONALITIES),
+    _build_features,
+)
+HOLIDAY_COLUMN_INDEX = {name: i for i, name in enumerate(STORE["holiday_columns"].tolist())}
+
+
+def to_cached_days(dates):
+    """
+    pd.Series ngày → mảng epoch-day nếu tất cả là nửa đêm, không múi giờ và
+    nằm trong cửa sổ của kho; ngược lại trả None (phải tính như bình thường).
+    """
+    if getattr(dates.dt, "tz", None) is not None or len(dates) == 0:
+        return None
+    ns = dates.to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    days, remainder = np.divmod(ns, NS_PER_DAY)
+    if remainder.any() or days.min() < FIRST_DAY or days.max() > LAST_DAY:
+        return None
+    return days
+
+
+def seasonality_features(days, period, series_order):
+    """Cột Fourier (ma trận mới, ghi được) cho các epoch-day, hoặc None nếu không có sẵn."""
+    for key, (cached_period, cached_order) in SEASONALITIES.items():
+        if cached_period == period and cached_order == series_order:
+            return STORE[key][days - FIRST_DAY]
+    return None
+
+
+def holiday_features(days, names=None):
+    """
+    Ma trận chỉ báo ngày lễ (float64) cho các epoch-day.
+    names: danh sách tên cần lấy (mặc định: mọi ngày lễ trong kho).
+    """
+    if names is None:
+        names = STORE["holiday_columns"].tolist()
+    columns = [HOLIDAY_COLUMN_INDEX[name] for name in names]
+    return STORE["holiday_indicator"][days - FIRST_DAY][:, columns].astype(np.float64), list(names)
+
+
+def vn_holidays(first_year, last_year):
+    """
+    DataFrame ngày lễ VN (ds, holiday) cho các năm [first_year, last_year],
+    giống kết quả của Prophet.add_country_holidays(country_name='VN').
+    """
+    if first_year < FEATURE_YEARS.start or last_year >= FEATURE_YEARS.stop:
+        return make_holidays_df(year_list=list(range(first_year, last_year + 1)), country="VN")
+
+    ds = STORE["holiday_ds"]
+    years = ds.astype("datetime64[Y]").astype(int) + 1970
+    mask = (years >= first_year) & (years <= last_year)
+    df = pd.DataFrame({
+        "ds": pd.to_datetime(ds[mask]),
+        "holiday": STORE["holiday_name"][mask],
+    })
+    # Bảng lấy nguyên từ kho → CachedProphet cắt thẳng holiday_indicator
+    df.attrs[VN_HOLIDAY_YEARS_ATTR] = (first_year, last_year)
+    return df
+
+
+class CachedProphet(Prophet):
+    """
+    Prophet lấy cột mùa vụ từ kho dựng sẵn thay vì tính lại trên toàn bộ lịch
+    sử mỗi request. Cột ngày lễ: nếu holidays là bảng của vn_holidays() thì cắt
+    thẳng từ holiday_indicator, bảng khác thì dựng bằng numpy từ đúng các cặp
+    (ngày, tên) được truyền vào. Kết quả giống hệt Prophet gốc; trường hợp kho
+    không phủ được (ngày lệch giờ, ngoài cửa sổ, ngày lễ tùy chỉnh có
+    window/prior_scale, múi giờ) thì quay về cách tính của Prophet.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Ghi nhận ngay từ đầu: Prophet copy/concat bảng holidays nên attrs
+        # không chắc còn tới make_holiday_features
+        holidays = self.holidays
+        self.vn_holiday_years = holidays.attrs.get(VN_HOLIDAY_YEARS_ATTR) if holidays is not None else None
+
+    @staticmethod
+    def fourier_series(dates, period, series_order):
+        days = to_cached_days(dates) if CACHE_ENABLED else None
+        if days is not None:
+            features = seasonality_features(days, period, series_order)
+            if features is not None:
+                return features
+        return Prophet.fourier_series(dates, period, series_order)
+
+    def make_holiday_features(self, dates, holidays):
+        custom = {"lower_window", "upper_window", "prior_scale"} & set(holidays.columns)
+        if not CACHE_ENABLED or custom or getattr(dates.dt, "tz", None) is not None:
+            return super().make_holiday_features(dates, holidays)
+
+        names = list(dict.fromkeys(holidays["holiday"]))
+        stock = (self.vn_holiday_years and self.country_holidays is None
+                 and all(name in HOLIDAY_COLUMN_INDEX for name in names))
+        days = to_cached_days(dates) if stock else None
+        if days is not None:
+            # Bảng VN gốc: cắt thẳng ma trận dựng sẵn, bỏ các ngày ngoài khoảng năm
+            # của bảng và các tên chỉ còn dòng NaT (Prophet thêm khi predict)
+            first_year, last_year = self.vn_holiday_years
+            matrix, _ = holiday_features(days, names)
+            years = days.astype("datetime64[D]").astype("datetime64[Y]").astype(int) + 1970
+            matrix[(years < first_year) | (years > last_year)] = 0
+            matrix[:, ~np.isin(names, holidays.loc[holidays["ds"].notna(), "holiday"].to_numpy())] = 0
+        else:
+            # Bảng khác: đánh dấu đúng các cặp (ngày, tên) được truyền vào — giống
+            # Prophet, chỉ so theo ngày — nhưng vector hóa thay vì get_loc từng dòng
+            date_days = dates.to_numpy(dtype="datetime64[ns]").astype("datetime64[D]")
+            holiday_days = pd.to_datetime(holidays["ds"]).to_numpy(dtype="datetime64[ns]").astype("datetime64[D]")
+            holiday_names = holidays["holiday"].to_numpy()
+            known = ~np.isnat(holiday_days)
+            matrix = np.zeros((len(date_days), len(names)))
+            for j, name in enumerate(names):
+                matrix[:, j] = np.isin(date_days, holiday_days[known & (holiday_names == name)])
+
+        # Giống Prophet: mỗi ngày lễ một cột "<tên>_delim_+0", sắp xếp theo tên
+        columns = [f"{name}_delim_+0" for name in names]
+        holiday_features_df = pd.DataFrame(matrix, columns=columns)
+        holiday_features_df = holiday_features_df[sorted(columns)]
+        prior_scale_list = [float(self.holidays_prior_scale)] * len(columns)
+
+        if self.train_holiday_names is None:
+            self.train_holiday_names = pd.Series(names)
+        return holiday_features_df, prior_scale_list, names
+
+
+def _seasonality_features(cls, df, future, holidays_df=None, country=None):
+    """Design matrix lúc fit (history) và lúc predict (future) của một mô hình."""
+    m = cls(daily_seasonality=False, holidays=holidays_df)
+    if country:
+        m.add_country_holidays(country_name=country)
+    m.history = m.setup_dataframe(df.copy(), initialize_scales=True)
+    m.history_dates = df["ds"]
+    m.set_auto_seasonalities()
+    fit = m.make_all_seasonality_features(m.history)
+    # Lúc predict train_holiday_names đã có: construct_holiday_dataframe bỏ ngày
+    # lễ chưa thấy khi fit và đệm dòng NaT cho ngày lễ không có trong tương lai
+    predict = m.make_all_seasonality_features(m.setup_dataframe(future.copy()))
+    return fit, predict
+
+
+def _self_check():
+    """
+    So design matrix của CachedProphet với Prophet gốc trên dữ liệu mẫu, cả lúc
+    fit lẫn lúc predict. CachedProphet dựa vào chi tiết nội bộ của Prophet (tên
+    cột "_delim_+0", train_holiday_names, dòng NaT khi predict...), nên khi nâng
+    cấp prophet mà kết quả lệch thì tắt cache và dùng Prophet gốc thay vì âm
+    thầm trả design matrix sai.
+    """
+    ds = pd.date_range("2023-03-01", "2025-06-30")
+    df = pd.DataFrame({"ds": ds, "y": np.arange(len(ds), dtype=float)})
+    # Quý 1/2026 thiếu vài ngày lễ đã có lúc fit (vd. "29 of Lunar New Year")
+    future = pd.DataFrame({"ds": pd.date_range("2026-01-01", "2026-03-31")})
+    custom = pd.DataFrame({"ds": pd.to_datetime(["2024-03-03"]), "holiday": ["Lunar New Year"]})
+
+    cases = [
+        {"holidays_df": vn_holidays(2023, 2025)},                                      # cắt từ kho
+        {"holidays_df": pd.concat([vn_holidays(2024, 2025), custom], ignore_index=True)},  # bảng tùy chỉnh
+        {"country": "VN"},                                                             # add_country_holidays
+    ]
+    for case in cases:
+        expected = _seasonality_features(Prophet, df, future, **case)
+        actual = _seasonality_features(CachedProphet, df, future, **case)
+        for (e_features, e_priors, e_cols, e_modes), (features, priors, cols, modes) in zip(expected, actual):
+            if not (e_features.equals(features) and e_priors == priors
+                    and e_cols.equals(cols) and e_modes == modes):
+                return False
+    return True
+
+
+try:
+    CACHE_ENABLED = _self_check()
+except Exception as e:
+    print(f"⚠️ Feature store self-check lỗi: {e}")
+    CACHE_ENABLED = False
+if not CACHE_ENABLED:
+    print("⚠️ CachedProphet không khớp Prophet gốc → tắt cache đặc trưng, dùng Prophet gốc")
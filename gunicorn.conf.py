@@ -0,0 +1,73 @@
+# Cấu hình Gunicorn cho chế độ nhiều worker tiết kiệm RAM.
+#
+# - preload_app: master import ocr.py (pandas, prophet, bảng ngày lễ, prompt)
+#   một lần TRƯỚC khi fork → các worker dùng chung trang nhớ (copy-on-write).
+# - Số worker được chọn theo ngân sách RAM đo được (cgroup của VM Fly 1GB),
+#   trừ đi RAM thực tế của master sau khi preload.
+# - WEB_CONCURRENCY vẫn ép được số worker cố định nếu cần.
+import gc
+import multiprocessing
+import os
+
+# space_pool đọc OCR_SPACES / OCR_TIMEOUT lúc import → load .env trước
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+import memstats
+import space_pool
+
+bind = f":{os.environ.get('PORT', 8080)}"
+preload_app = True
+
+# Một request /ocr có thể thử lần lượt mọi replica, mỗi replica tới OCR_TIMEOUT,
+# rồi còn gọi Gemini → timeout của worker phải lớn hơn tổng đó, nếu không worker
+# bị SIGKILL trước khi kịp chuyển sang replica khác
+GEMINI_HEADROOM_S = 60
+timeout = int(space_pool.OCR_TIMEOUT * len(space_pool.OCR_SPACES) + GEMINI_HEADROOM_S)
+
+# RAM riêng ước tính mỗi worker cần thêm khi xử lý request (fit Prophet + cmdstan)
+WORKER_MEM_MB = int(os.environ.get("WORKER_MEM_MB", 200))
+# Ước tính RAM của master trước khi đo được thực tế (pandas + prophet + gradio_client)
+MASTER_MEM_MB = int(os.environ.get("MASTER_MEM_MB", 350))
+# Chừa lại cho kernel, page cache...
+RESERVE_MEM_MB = int(os.environ.get("RESERVE_MEM_MB", 100))
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+
+FIXED_WORKERS = int(os.environ.get("WEB_CONCURRENCY", 0))
+
+workers = FIXED_WORKERS or memstats.workers_for_budget(
+    memstats.memory_budget_mb(), MASTER_MEM_MB, WORKER_MEM_MB, MAX_WORKERS, RESERVE_MEM_MB
+)
+
+
+def when_ready(server):
+    # App đã được preload trong master → đo lại RAM thật và chỉnh số worker
+    os.environ["OCR_MASTER_PID"] = str(os.getpid())
+
+    master = memstats.process_memory()
+    budget = memstats.memory_budget_mb()
+    if not FIXED_WORKERS:
+        server.num_workers = memstats.workers_for_budget(
+            budget, master["rss_mb"], WORKER_MEM_MB, MAX_WORKERS, RESERVE_MEM_MB
+        )
+
+    print(f"🧠 Master RSS {master['rss_mb']} MB / budget {budget} MB "
+          f"→ {server.num_workers} worker(s), ~{WORKER_MEM_MB} MB mỗi worker")
+
+    # Đóng băng các object đã có để GC của worker không ghi vào chúng
+    # (ghi vào header object sẽ làm tách trang copy-on-write)
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Mỗi worker có client Space OCR riêng (thread/client không qua được fork);
+    # trạng thái replica dùng chung qua file, chỉ một worker được bầu làm warm-up
+    space_pool.get_pool()
+
+    mem = memstats.process_memory()
+    print(f"👷 Worker {worker.pid} started: RSS {mem['rss_mb']} MB, "
+          f"private {mem['private_mb']} MB")
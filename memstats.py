@@ -0,0 +1,126 @@
+"""
+Đo bộ nhớ cho chế độ chạy nhiều worker (gunicorn --preload).
+
+Dùng chung cho gunicorn.conf.py (chọn số worker) và endpoint /memory
+trong ocr.py (báo cáo RSS từng worker). Chỉ đọc /proc nên chỉ chính xác
+trên Linux; nơi khác trả về 0 thay vì lỗi.
+"""
+import os
+
+MB = 1024 * 1024
+
+
+def _read_int(path):
+    try:
+        with open(path) as fh:
+            value = fh.read().strip()
+    except OSError:
+        return None
+    if not value.isdigit():
+        # cgroup v2 ghi "max" khi không giới hạn
+        return None
+    return int(value)
+
+
+def memory_budget_mb():
+    """
+    Ngân sách RAM của máy/container (MB), theo thứ tự ưu tiên:
+    MEMORY_BUDGET_MB → giới hạn cgroup v2 → cgroup v1 → MemTotal.
+    """
+    override = os.environ.get("MEMORY_BUDGET_MB")
+    if override:
+        return int(override)
+
+    for path in ("/sys/fs/cgroup/memory.max",
+                 "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        limit = _read_int(path)
+        # cgroup v1 dùng một số rất lớn để biểu thị "không giới hạn"
+        if limit and limit < 1 << 50:
+            return limit // MB
+
+    try:
+        with open("/proc/meminfo") as fh:
+            for line in fh:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return 0
+
+
+def process_memory(pid=None):
+    """
+    Bộ nhớ của một process (MB).
+
+    - rss: tổng trang đang nằm trong RAM (đếm cả trang chia sẻ)
+    - pss: phần RAM "thực sự" thuộc process (trang chia sẻ chia đều)
+    - shared / private: trang copy-on-write còn chung với master / đã bị tách
+    """
+    pid = pid or os.getpid()
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as fh:
+            for line in fh:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+    except OSError:
+        pass
+
+    if not fields:
+        # Kernel cũ không có smaps_rollup → chỉ lấy được VmRSS
+        try:
+            with open(f"/proc/{pid}/status") as fh:
+                for line in fh:
+                    if line.startswith("VmRSS:"):
+                        fields["Rss"] = int(line.split()[1])
+        except OSError:
+            pass
+
+    def mb(*keys):
+        return round(sum(fields.get(k, 0) for k in keys) / 1024, 1)
+
+    return {
+        "pid": pid,
+        "rss_mb": mb("Rss"),
+        "pss_mb": mb("Pss"),
+        "shared_mb": mb("Shared_Clean", "Shared_Dirty"),
+        "private_mb": mb("Private_Clean", "Private_Dirty"),
+    }
+
+
+def child_pids(parent_pid):
+    """Liệt kê các process con trực tiếp (các worker gunicorn của master)."""
+    children = []
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return children
+
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as fh:
+                stat = fh.read()
+        except OSError:
+            continue
+        # Trường thứ 4 là ppid; tên process nằm trong (...) có thể chứa dấu cách
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        if ppid == parent_pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def workers_for_budget(budget_mb, master_mb, worker_mb, max_workers, reserve_mb=0):
+    """
+    Số worker tối đa vừa ngân sách RAM.
+
+    Nhờ preload + copy-on-write, mỗi worker chỉ tốn thêm phần RAM riêng
+    (worker_mb: bộ nhớ làm việc khi fit Prophet, gọi Gemini...), còn phần
+    thư viện đã nạp trong master (master_mb) được dùng chung.
+    """
+    available = budget_mb - master_mb - reserve_mb
+    if worker_mb <= 0 or available <= 0:
+        return 1
+    return max(1, min(max_workers, int(available // worker_mb)))
@@ -1,13 +1,15 @@
+import click
 from flask import Flask, request, jsonify
-from gradio_client import Client, handle_file
 import os
 import requests
 import json
+import tempfile
+import time
 from datetime import datetime
 from datetime import timezone
 from calendar import monthrange
+import numpy as np
 import pandas as pd
-from prophet import Prophet
 
 # ✅ Tự động load file .env nếu có
 try:
@@ -16,10 +18,27 @@ try:
 except ImportError:
     pass
 
+# Module nội bộ đọc biến môi trường lúc import → import sau khi đã load .env
+import memstats
+import ocr_store
+import space_pool
+from features import CachedProphet, vn_holidays
+from transactions import PayloadError, daily_totals, epoch_day, parse_transactions, to_amounts, to_epoch_days
+
 app = Flask(__name__)
 
-# ✅ Hugging Face Space OCR
-client = Client("hoangphuc05/ocr-invoice")
+# ✅ Kho văn bản OCR (SQLite) — tránh OCR lại cùng một ảnh.
+# Store chỉ là cache: lỗi store (DB bị khóa, đầy ổ, thiếu volume...) chỉ log,
+# /ocr vẫn OCR trực tiếp như bình thường
+def try_store(action, *args):
+    try:
+        return action(*args)
+    except Exception as e:
+        print(f"⚠️ OCR store {action.__name__} lỗi: {e}")
+        return None
+
+
+try_store(ocr_store.init_store)
 
 # ✅ Gemini API config
 GEMINI_API_KEY_VOICE = os.environ.get("GEMINI_API_KEY_VOICE")
@@ -42,46 +61,9 @@ def get_gemini_url(api_key):
     return f"https://generativelanguage.googleapis.com/{GEMINI_VERSION}/models/{GEMINI_MODEL}:generateContent?key={api_key}"
 
 
-
-@app.route("/ocr", methods=["POST"])
-def ocr_and_analyze():
-    
-    print("🔔 New /ocr request received")
-    print("/n" * 5)
-
-    url_ocr = get_gemini_url(GEMINI_API_KEY_OCR)
-
-    """
-    Nhận ảnh + danh sách categories → OCR → Gọi Gemini → Trả JSON gồm:
-    store_name, date, total_amount, currency, categoryId
-    """
-    if "image" not in request.files:
-        return jsonify({"error": "❌ No image uploaded"}), 400
-
-    f = request.files["image"]
-    temp_path = f"temp_{f.filename}"
-    f.save(temp_path)
-
-    # ✅ Lấy danh sách category nếu có
-    categories_json = request.form.get("categories")
-    categories = None
-    if categories_json:
-        try:
-            categories = json.loads(categories_json)
-        except json.JSONDecodeError:
-            return jsonify({"error": "Invalid JSON format for 'categories'"}), 400
-
-    try:
-        # 1️⃣ OCR
-        ocr_text = client.predict(handle_file(temp_path), api_name="/predict")
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-
-        ocr_text = ocr_text.strip() if isinstance(ocr_text, str) else str(ocr_text)
-        print("🧾 OCR text preview:\n", ocr_text[:300])
-
-                # 2️⃣ Prompt: thêm hướng dẫn phân loại category + quy tắc tiền Việt
-        prompt = f"""
+# ✅ Prompt tĩnh được dựng sẵn ở cấp module (nạp một lần trong master rồi dùng chung
+# sau fork); mỗi request chỉ điền phần thay đổi bằng str.format.
+OCR_PROMPT_TEMPLATE = """
 BẠN LÀ CHUYÊN GIA TRÍCH XUẤT THÔNG TIN HÓA ĐƠN (INVOICE/RECEIPT) ĐA NGÔN NGỮ VỚI KHẢ NĂNG SỬA LỖI OCR.
 
 ==================================================
@@ -121,7 +103,7 @@ Phân tích văn bản OCR và trích xuất thông tin hóa đơn thành JSON v
 ==================================================
 DANH SÁCH CATEGORY KHẢ DỤNG:
 ==================================================
-{json.dumps(categories, indent=2) if categories else "[]"}
+{categories}
 
 ==================================================
 QUY TẮC TRÍCH XUẤT:
@@ -137,7 +119,7 @@ QUY TẮC TRÍCH XUẤT:
    - Các định dạng phổ biến: dd/mm/yyyy, dd-mm-yyyy, yyyy-mm-dd
    - Từ khóa: "Date", "Ngày", "Time", "Thời gian"
    - ⚠️ **QUAN TRỌNG - Xử lý ngày tương lai:**
-     * Nếu ngày > ngày hiện tại ({datetime.now().strftime("%d/%m/%Y")}) → DÙNG NGÀY HIỆN TẠI
+     * Nếu ngày > ngày hiện tại ({today}) → DÙNG NGÀY HIỆN TẠI
      * Nếu năm > 2025 (lỗi OCR như "2625") → Sửa thành năm hiện tại
      * Nếu KHÔNG tìm thấy ngày HOẶC không parse được → DÙNG NGÀY HIỆN TẠI
    - Format output: dd/mm/yyyy
@@ -209,11 +191,11 @@ Phân tích:
 - "THANH PHO HO CHIMINH" → TP. Hồ Chí Minh
 - "Ciave6,000 dong" → Giá vé 6,000 đồng
 - "Ngy16/11/2625" → Năm 2625 là lỗi OCR → Sửa thành 16/11/2025
-- Nếu 16/11/2025 > ngày hiện tại → Dùng ngày hiện tại {datetime.now().strftime("%d/%m/%Y")}
+- Nếu 16/11/2025 > ngày hiện tại → Dùng ngày hiện tại {today}
 Output:
 {{
   "store_name": "NGYIDVVIHHTHA - Chi nhánh TP HCM",
-  "date": "{datetime.now().strftime("%d/%m/%Y")}",
+  "date": "{today}",
   "total_amount": 6000,
   "currency": "VND",
   "categoryId": "[ID của Di chuyển hoặc Xe cộ]",
@@ -283,79 +265,207 @@ YÊU CẦU OUTPUT:
 """
 
 
+# Tăng số này mỗi khi sửa OCR_PROMPT_TEMPLATE → `flask --app ocr reextract`
+# sẽ trích xuất lại các ảnh đã lưu bằng prompt mới (không cần OCR lại)
+OCR_PROMPT_VERSION = 1
 
-        # 3️⃣ Gọi Gemini
-        payload = {"contents": [{"parts": [{"text": prompt}]}]}
-        response = requests.post(url_ocr, json=payload)
-        data = response.json()
 
-        if "candidates" not in data:
-            return jsonify({
-                "error": "Gemini API returned no candidates",
-                "gemini_response": data
-            }), 500
+def extract_invoice(ocr_text, categories):
+    """
+    Văn bản OCR + categories → Gemini → dict gọn (Note, TransactionDate, Amount, ...).
+    Trả về (kết quả, None) hoặc (None, payload lỗi của Gemini).
+    """
+    url_ocr = get_gemini_url(GEMINI_API_KEY_OCR)
 
-        gemini_text = data["candidates"][0]["content"]["parts"][0]["text"]
+    # 2️⃣ Prompt: thêm hướng dẫn phân loại category + quy tắc tiền Việt
+    prompt = OCR_PROMPT_TEMPLATE.format(
+        categories=json.dumps(categories, indent=2) if categories else "[]",
+        today=datetime.now().strftime("%d/%m/%Y"),
+        ocr_text=ocr_text,
+    )
+
+    # 3️⃣ Gọi Gemini
+    payload = {"contents": [{"parts": [{"text": prompt}]}]}
+    response = requests.post(url_ocr, json=payload)
+    data = response.json()
+
+    if "candidates" not in data:
+        return None, {
+            "error": "Gemini API returned no candidates",
+            "gemini_response": data
+        }
 
-        # 4️⃣ Làm sạch JSON
-        cleaned = gemini_text.replace("```json", "").replace("```", "").strip()
+    gemini_text = data["candidates"][0]["content"]["parts"][0]["text"]
 
-        try:
-            json_data = json.loads(cleaned)
-        except json.JSONDecodeError:
-            json_data = {"raw_text": cleaned}
-
-        # ✅ 5️⃣ Trả kết quả gọn
-        filtered = {
-            "Note": json_data.get("store_name"),
-            "TransactionDate": json_data.get("date"),
-            "Amount": json_data.get("total_amount"),
-            "Currency": json_data.get("currency"),
-            "CategoryId": json_data.get("categoryId"),
-            "NeedRescan": json_data.get("needRescan")
-        }
+    # 4️⃣ Làm sạch JSON
+    cleaned = gemini_text.replace("```json", "").replace("```", "").strip()
 
-        return jsonify(filtered)
+    try:
+        json_data = json.loads(cleaned)
+    except json.JSONDecodeError:
+        json_data = {"raw_text": cleaned}
+
+    # ✅ 5️⃣ Trả kết quả gọn
+    filtered = {
+        "Note": json_data.get("store_name"),
+        "TransactionDate": json_data.get("date"),
+        "Amount": json_data.get("total_amount"),
+        "Currency": json_data.get("currency"),
+        "CategoryId": json_data.get("categoryId"),
+        "NeedRescan": json_data.get("needRescan")
+    }
+    return filtered, None
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+
+def parse_categories_form():
+    """Đọc field 'categories' (JSON) từ form. Trả về (categories, lỗi)."""
+    categories_json = request.form.get("categories")
+    if not categories_json:
+        return None, None
+    try:
+        return json.loads(categories_json), None
+    except json.JSONDecodeError:
+        return None, "Invalid JSON format for 'categories'"
+
+
+@app.route("/ocr", methods=["POST"])
+def ocr_and_analyze():
     
+    print("🔔 New /ocr request received")
+    print("/n" * 5)
 
-    # ================================================================
-# 2) NEW API — Classify Expenses (như C# ClassifyExpensesAsync)
-# ================================================================
-@app.route("/classify-expense", methods=["POST"])
-def classify_expenses():
     """
-    Input:
-    {
-        "prompt": "hôm nay đi siêu thị mua đồ 150k",
-        "categories": [
-            { "Id": "guid...", "Name": "Ăn uống", "Type": "Expense" },
-            { "Id": "guid...", "Name": "Mua sắm", "Type": "Expense" },
-            { "Id": "guid...", "Name": "Lương", "Type": "Income" }
-        ]
-    }
+    Nhận ảnh + danh sách categories → OCR → Gọi Gemini → Trả JSON gồm:
+    store_name, date, total_amount, currency, categoryId
+    (+ ImageHash để gọi /ocr/reextract mà không cần upload lại ảnh)
     """
+    if "image" not in request.files:
+        return jsonify({"error": "❌ No image uploaded"}), 400
 
-    url_voice = get_gemini_url(GEMINI_API_KEY_VOICE)
+    f = request.files["image"]
+    image_bytes = f.read()
+    image_hash = ocr_store.image_hash(image_bytes)
+
+    # ✅ Lấy danh sách category nếu có
+    categories, error = parse_categories_form()
+    if error:
+        return jsonify({"error": error}), 400
 
     try:
-        data = request.get_json()
+        # 1️⃣ OCR — ảnh đã OCR trước đó thì lấy lại văn bản từ store
+        stored = try_store(ocr_store.get, image_hash)
+        if stored:
+            ocr_text = stored["ocr_text"]
+            print(f"♻️ OCR text reused from store ({image_hash[:12]})")
+        else:
+            # File tạm riêng cho từng request: nhiều worker có thể cùng nhận
+            # "image.jpg" → không được ghi đè / xóa file của request khác
+            suffix = os.path.splitext(f.filename or "")[1]
+            with tempfile.NamedTemporaryFile(prefix="ocr-", suffix=suffix, delete=False) as fh:
+                fh.write(image_bytes)
+                temp_path = fh.name
+            try:
+                ocr_text = space_pool.get_pool().predict(temp_path)
+            finally:
+                os.remove(temp_path)
+
+            ocr_text = ocr_text.strip() if isinstance(ocr_text, str) else str(ocr_text)
+            try_store(ocr_store.put_ocr, image_hash, ocr_text)
+        print("🧾 OCR text preview:\n", ocr_text[:300])
 
-        prompt = data.get("prompt")
-        categories = data.get("categories", [])
+        # 2️⃣ → 5️⃣ Gemini trích xuất thông tin hóa đơn
+        filtered, error = extract_invoice(ocr_text, categories)
+        if error:
+            return jsonify(error), 500
 
-        if not prompt:
-            return jsonify({"error": "prompt is required"}), 400
+        try_store(ocr_store.put_extraction, image_hash, categories, filtered, OCR_PROMPT_VERSION)
+        return jsonify({**filtered, "ImageHash": image_hash})
 
-        # ===== Mapping categories với Type =====
-        category_mapping = "\n".join([f"- {c['Name']} (ID: {c['Id']}, Type: {c.get('Type', 'Unknown')})" for c in categories])
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        # ===== Build instruction (không có emotion) =====
-        instruction = f"""
+@app.route("/ocr/reextract", methods=["POST"])
+def ocr_reextract():
+    """
+    Chạy lại bước trích xuất (Gemini) từ văn bản OCR đã lưu, KHÔNG OCR lại.
+    Dùng khi user sửa categories hoặc sau khi đổi prompt.
+
+    Input (form hoặc JSON):
+        image_hash: hash trả về từ /ocr  (hoặc gửi lại file "image")
+        categories: danh sách category mới (bỏ trống → dùng lại danh sách cũ)
+    """
+    if request.is_json:
+        body = request.get_json(silent=True) or {}
+        if not isinstance(body, dict):
+            return jsonify({"error": "JSON body must be an object"}), 400
+        image_hash = body.get("image_hash")
+        categories = body.get("categories")
+    else:
+        image_hash = request.form.get("image_hash")
+        categories, error = parse_categories_form()
+        if error:
+            return jsonify({"error": error}), 400
+        if not image_hash and "image" in request.files:
+            image_hash = ocr_store.image_hash(request.files["image"].read())
+
+    if not image_hash:
+        return jsonify({"error": "image_hash or image is required"}), 400
+
+    try:
+        stored = ocr_store.get(image_hash)
+        if stored is None:
+            return jsonify({"error": "No stored OCR text for this image, call /ocr first"}), 404
+
+        if categories is None:
+            categories = stored["categories"]
+
+        filtered, error = extract_invoice(stored["ocr_text"], categories)
+        if error:
+            return jsonify(error), 500
+
+        try_store(ocr_store.put_extraction, image_hash, categories, filtered, OCR_PROMPT_VERSION)
+        return jsonify({**filtered, "ImageHash": image_hash})
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@app.cli.command("reextract")
+@click.option("--limit", type=int, default=None, help="Số ảnh tối đa cần xử lý.")
+@click.option("--delay", type=float, default=0.0, help="Nghỉ (giây) giữa các lần gọi Gemini.")
+@click.option("--vacuum", is_flag=True, help="Chạy VACUUM sau khi xong.")
+def reextract_command(limit, delay, vacuum):
+    """Trích xuất lại các ảnh đã lưu có kết quả từ prompt cũ (không OCR lại)."""
+    total = ocr_store.count_stale(OCR_PROMPT_VERSION)
+    if limit:
+        total = min(total, limit)
+    print(f"🔁 {total} ảnh cần trích xuất lại với prompt v{OCR_PROMPT_VERSION}")
+
+    done = failed = 0
+    for record in ocr_store.iter_stale(OCR_PROMPT_VERSION, limit):
+        done += 1
+        # Một ảnh lỗi (mạng, Gemini 5xx, thiếu API key...) không được dừng cả đợt migrate
+        try:
+            filtered, error = extract_invoice(record["ocr_text"], record["categories"])
+            if error:
+                failed += 1
+                print(f"❌ {record['image_hash'][:12]}: {error['error']}")
+            else:
+                ocr_store.put_extraction(record["image_hash"], record["categories"], filtered, OCR_PROMPT_VERSION)
+        except Exception as e:
+            failed += 1
+            print(f"❌ {record['image_hash'][:12]}: {e}")
+        if done % 50 == 0:
+            print(f"   ... {done}/{total}")
+        if delay:
+            time.sleep(delay)
+
+    ocr_store.compact(full=vacuum)
+    print(f"✅ Xong: {done - failed} thành công, {failed} lỗi. {ocr_store.stats()}")
+    
+
+CLASSIFY_EXPENSE_TEMPLATE = """
 BẠN LÀ CHUYÊN GIA PHÂN TÍCH TÀI CHÍNH TIẾNG VIỆT.
 
 NGÀY GIỜ HIỆN TẠI: {now}
@@ -475,6 +585,47 @@ Trả về JSON đúng format sau (KHÔNG thêm markdown, KHÔNG giải thích):
 }}
 """
 
+
+    # ================================================================
+# 2) NEW API — Classify Expenses (như C# ClassifyExpensesAsync)
+# ================================================================
+@app.route("/classify-expense", methods=["POST"])
+def classify_expenses():
+    """
+    Input:
+    {
+        "prompt": "hôm nay đi siêu thị mua đồ 150k",
+        "categories": [
+            { "Id": "guid...", "Name": "Ăn uống", "Type": "Expense" },
+            { "Id": "guid...", "Name": "Mua sắm", "Type": "Expense" },
+            { "Id": "guid...", "Name": "Lương", "Type": "Income" }
+        ]
+    }
+    """
+
+    url_voice = get_gemini_url(GEMINI_API_KEY_VOICE)
+
+    try:
+        data = request.get_json()
+
+        prompt = data.get("prompt")
+        categories = data.get("categories", [])
+
+        if not prompt:
+            return jsonify({"error": "prompt is required"}), 400
+
+        # ===== Mapping categories với Type =====
+        category_mapping = "\n".join([f"- {c['Name']} (ID: {c['Id']}, Type: {c.get('Type', 'Unknown')})" for c in categories])
+
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        # ===== Build instruction (không có emotion) =====
+        instruction = CLASSIFY_EXPENSE_TEMPLATE.format(
+            now=now,
+            category_mapping=category_mapping,
+            prompt=prompt,
+        )
+
         # ===== Gemini Call Payload =====
         payload = {
             "contents": [
@@ -505,6 +656,42 @@ Trả về JSON đúng format sau (KHÔNG thêm markdown, KHÔNG giải thích):
         return jsonify({"error": str(e)}), 500
     
 
+EMAIL_INSTRUCTION_TEMPLATE = """Bạn là chuyên gia phân loại email. Nhiệm vụ của bạn là xác định xem email có phải là hóa đơn (invoice), biên lai (receipt), hay thông báo thanh toán không.
+
+Các dấu hiệu email là hóa đơn/biên lai:
+- Tiêu đề chứa từ khóa: hóa đơn, invoice, receipt, biên lai, thanh toán, payment, order, đơn hàng
+- Nội dung chứa thông tin: số tiền, tổng tiền, total, amount, giá trị, VAT, thuế
+- Có thông tin về giao dịch mua bán, thanh toán
+- Có mã đơn hàng, mã giao dịch
+- Đến từ các nhà cung cấp dịch vụ, cửa hàng, siêu thị, ứng dụng thanh toán
+
+Ngày hiện tại (UTC) là: {current_date}. Nếu không xác định được ngày giao dịch trong email, hãy dùng ngày hiện tại (UTC).
+
+Trả về JSON với format:
+{{
+  "isInvoice": true/false,
+  "confidence": 0.0-1.0 (độ tin cậy),
+  "reason": "Lý do phân loại",
+  "amount": number (số tiền nếu tìm thấy, nếu không để null),
+  "note": "ghi chú ngắn gọn về giao dịch (nếu có)",
+  "categoryId": "GUID của category nếu map được từ danh sách category cung cấp",
+  "transactionDate": "Ngày giao dịch (ISO 8601), nếu không có thì trả null"
+}}"""
+
+EMAIL_CATEGORY_TEMPLATE = """
+
+Danh sách category khả dụng:
+{cat_lines}
+
+**QUAN TRỌNG về categoryId:**
+- BẮT BUỘC phải chọn một categoryId từ danh sách trên.
+- Nếu email là hóa đơn/biên lai (isInvoice=true), hãy phân tích nội dung và chọn category phù hợp nhất.
+- Ví dụ: Vé xem phim → "Giải trí", siêu thị → "Mua sắm", nhà hàng → "Ăn uống", v.v.
+- Nếu không chắc chắn, hãy chọn category gần nhất dựa trên ngữ cảnh.
+- KHÔNG ĐƯỢC để categoryId là null nếu isInvoice = true.
+"""
+
+
 # 3️⃣ [MỚI] API Phân loại Email (Port từ C# sang)
 @app.route("/classify-email", methods=["POST"])
 def classify_email():
@@ -538,45 +725,14 @@ def classify_email():
         print("-----------------------------")
 
         # 1. Xây dựng Prompt (Dịch từ C#)
-        instruction = f"""Bạn là chuyên gia phân loại email. Nhiệm vụ của bạn là xác định xem email có phải là hóa đơn (invoice), biên lai (receipt), hay thông báo thanh toán không.
-
-Các dấu hiệu email là hóa đơn/biên lai:
-- Tiêu đề chứa từ khóa: hóa đơn, invoice, receipt, biên lai, thanh toán, payment, order, đơn hàng
-- Nội dung chứa thông tin: số tiền, tổng tiền, total, amount, giá trị, VAT, thuế
-- Có thông tin về giao dịch mua bán, thanh toán
-- Có mã đơn hàng, mã giao dịch
-- Đến từ các nhà cung cấp dịch vụ, cửa hàng, siêu thị, ứng dụng thanh toán
-
-Ngày hiện tại (UTC) là: {current_date}. Nếu không xác định được ngày giao dịch trong email, hãy dùng ngày hiện tại (UTC).
-
-Trả về JSON với format:
-{{
-  "isInvoice": true/false,
-  "confidence": 0.0-1.0 (độ tin cậy),
-  "reason": "Lý do phân loại",
-  "amount": number (số tiền nếu tìm thấy, nếu không để null),
-  "note": "ghi chú ngắn gọn về giao dịch (nếu có)",
-  "categoryId": "GUID của category nếu map được từ danh sách category cung cấp",
-  "transactionDate": "Ngày giao dịch (ISO 8601), nếu không có thì trả null"
-}}"""
+        instruction = EMAIL_INSTRUCTION_TEMPLATE.format(current_date=current_date)
 
         if categories:
             cat_lines = "\n".join([
             f"- {c.get('Name', c.get('name', 'Unknown'))} (ID: {c.get('Id', c.get('id', 'Unknown'))})" 
             for c in categories
         ])
-            instruction += f"""
-
-Danh sách category khả dụng:
-{cat_lines}
-
-**QUAN TRỌNG về categoryId:**
-- BẮT BUỘC phải chọn một categoryId từ danh sách trên.
-- Nếu email là hóa đơn/biên lai (isInvoice=true), hãy phân tích nội dung và chọn category phù hợp nhất.
-- Ví dụ: Vé xem phim → "Giải trí", siêu thị → "Mua sắm", nhà hàng → "Ăn uống", v.v.
-- Nếu không chắc chắn, hãy chọn category gần nhất dựa trên ngữ cảnh.
-- KHÔNG ĐƯỢC để categoryId là null nếu isInvoice = true.
-"""
+            instruction += EMAIL_CATEGORY_TEMPLATE.format(cat_lines=cat_lines)
 
         body_preview = body[:1000] + "..." if len(body) > 1000 else body
         email_content = f"Tiêu đề: {subject}\n\nTóm tắt: {snippet}\n\nNội dung: {body_preview}"
@@ -645,78 +801,86 @@ Danh sách category khả dụng:
 @app.route("/forecast", methods=["POST"])
 def forecast_current_month():
     """
-    Nhận vào một list/array [{date, amount}, ...] 
-    và trả về con số ước lượng cho tháng hiện tại.
+    Nhận vào danh sách giao dịch và trả về con số ước lượng cho tháng hiện tại.
     
-    Input: 
+    Input (application/json):
     [
         {"date": "2024-12-01", "amount": 100},
         {"date": "2024-12-02", "amount": 200},
         ...
     ]
+    hoặc dạng cột gọn hơn cho lịch sử dài:
+    {"date": ["2024-12-01", "2024-12-02", ...], "amount": [100, 200, ...]}
+    
+    Cũng nhận text/csv (header "date,amount") và Arrow IPC
+    (application/vnd.apache.arrow.stream) — xem transactions.py.
     
     Output: 150000 (số tiền dự đoán)
     """
     try:
-        transactions = request.get_json()
-        
-        # Kiểm tra input
-        if not transactions or not isinstance(transactions, list):
-            return jsonify(0)
-        
-        # 1. Chuyển đổi dữ liệu
-        df = pd.DataFrame(transactions)
-        
-        # Ép kiểu datetime, lỗi thì bỏ qua (coerce)
-        df['ds'] = pd.to_datetime(df['date'], errors='coerce') 
-        df = df.dropna(subset=['ds'])  # Bỏ các dòng lỗi ngày tháng
-        df['y'] = pd.to_numeric(df['amount'], errors='coerce').fillna(0)  # Ép kiểu số
+        # JSON hợp lệ vẫn có thể sai kiểu phần tử (vd. mảng lồng nhau) → lỗi khi
+        # ép kiểu bằng numpy, nên ép kiểu cũng nằm trong khối trả 400
+        try:
+            dates, amounts = parse_transactions(request.get_data(), request.content_type)
+
+            # Kiểm tra input
+            if len(dates) == 0:
+                return jsonify(0)
 
-        if df.empty:
+            # 1. Chuyển đổi dữ liệu → epoch-day (int) + số tiền (float), bỏ dòng lỗi ngày tháng
+            days, valid = to_epoch_days(dates)
+            days = days[valid]
+            y = to_amounts(amounts)[valid]
+        except (PayloadError, ValueError, TypeError) as e:
+            return jsonify({"error": f"Invalid transactions payload: {e}"}), 400
+
+        if len(days) == 0:
             return jsonify(0)
         
-        print("📊 DataFrame parsed from transactions:")
-        print(df.to_markdown(index=False))
-        print()
+        first_day = int(days.min())
+        last_transaction_day = int(days.max())  # Ngày cuối cùng user có nhập liệu
+        print(f"📊 Parsed {len(days)} transactions "
+              f"({np.datetime64(first_day, 'D')} → {np.datetime64(last_transaction_day, 'D')})")
 
         # 2. Xác định mốc thời gian (tháng hiện tại)
         now = datetime.now()
         target_month = now.month
         target_year = now.year
         
-        # Ngày cuối cùng user có nhập liệu
-        last_transaction_date = df['ds'].max()
-        
         # Ngày cuối cùng của tháng hiện tại
         _, last_day_of_month = monthrange(target_year, target_month)
         end_of_month_date = pd.Timestamp(year=target_year, month=target_month, day=last_day_of_month)
+        month_start_day = epoch_day(end_of_month_date.replace(day=1))
+        end_of_month_day = epoch_day(end_of_month_date)
 
         # 3. Tính TỔNG THỰC TẾ của tháng hiện tại
-        current_month_mask = (df['ds'].dt.month == target_month) & (df['ds'].dt.year == target_year)
-        actual_spending = df[current_month_mask]['y'].sum()
+        current_month_mask = (days >= month_start_day) & (days <= end_of_month_day)
+        actual_spending = float(y[current_month_mask].sum())
 
         # Nếu dữ liệu đã vượt qua tháng này -> Trả về tổng thực tế
-        if last_transaction_date >= end_of_month_date:
+        if last_transaction_day >= end_of_month_day:
             print(f"✅ Tháng {target_month}/{target_year} đã kết thúc. Trả về tổng thực tế.")
             return jsonify(round(actual_spending, 0))
 
         # Nếu chưa hết tháng -> Chạy AI (PROPHET)
-        # Group data theo ngày để train
-        df_daily = df.groupby('ds')['y'].sum().reset_index()
-        
-        # ✅ QUAN TRỌNG: Fill 0 từ ngày đầu tiên đến NGÀY HIỆN TẠI (không phải ngày giao dịch cuối)
+        # ✅ QUAN TRỌNG: Cộng theo ngày và fill 0 từ ngày đầu tiên đến NGÀY HIỆN TẠI
+        # (không phải ngày giao dịch cuối) — np.bincount trên epoch-day
         today = pd.Timestamp(now.date())  # Chuyển datetime thành Timestamp cho khớp kiểu
-        full_range = pd.date_range(start=df_daily['ds'].min(), end=today)
-        df_daily = df_daily.set_index('ds').reindex(full_range, fill_value=0).reset_index()
-        df_daily.columns = ['ds', 'y']
+        daily = daily_totals(days, y, first_day, epoch_day(today))
+        df_daily = pd.DataFrame({
+            'ds': pd.to_datetime(np.arange(first_day, first_day + len(daily)), unit='D'),
+            'y': daily,
+        })
         
-        # In ra data sau khi fill missing dates với 0
-        print("📅 Data sau khi fill 0 cho ngày không có giao dịch (đến ngày hiện tại):")
-        print(df_daily.to_markdown(index=False))
+        # In ra vài ngày cuối sau khi fill missing dates với 0
+        print(f"📅 {len(df_daily)} ngày dữ liệu (đã fill 0 đến ngày hiện tại), 14 ngày cuối:")
+        print(df_daily.tail(14).to_markdown(index=False))
         print()
 
-        m = Prophet(daily_seasonality=False)
-        m.add_country_holidays(country_name='VN')
+        # Ngày lễ VN + cột mùa vụ lấy từ kho đặc trưng dựng sẵn (features.py)
+        # thay cho m.add_country_holidays và tính lại Fourier mỗi request
+        holidays_df = vn_holidays(df_daily['ds'].min().year, target_year)
+        m = CachedProphet(daily_seasonality=False, holidays=holidays_df)
         m.fit(df_daily)
 
         # ✅ Dự đoán số ngày còn lại từ NGÀY HIỆN TẠI đến cuối tháng
@@ -752,6 +916,35 @@ def forecast_current_month():
 
     
 
+@app.route("/memory", methods=["GET"])
+def memory_report():
+    """
+    Báo cáo RAM của master và từng worker gunicorn (MB).
+    pss_mb là con số nên cộng lại để so với ngân sách RAM của VM,
+    vì rss_mb đếm trùng các trang dùng chung sau preload.
+    """
+    master_pid = int(os.environ.get("OCR_MASTER_PID", os.getpid()))
+    master = memstats.process_memory(master_pid)
+    workers = [memstats.process_memory(pid) for pid in memstats.child_pids(master_pid)]
+
+    return jsonify({
+        "budget_mb": memstats.memory_budget_mb(),
+        "master": master,
+        "workers": workers,
+        "served_by": os.getpid(),
+        "total_pss_mb": round(master["pss_mb"] + sum(w["pss_mb"] for w in workers), 1),
+    })
+
+
+@app.route("/ocr/space-stats", methods=["GET"])
+def ocr_space_stats():
+    """
+    Trạng thái các Space OCR của worker đang phục vụ: khỏe/bị loại, còn ấm
+    không, độ trễ, số request đang chờ (queue depth).
+    """
+    return jsonify(space_pool.get_pool().stats())
+
+
 # Thêm đoạn này để cron-job ping vào không bị lỗi 404
 @app.route("/", methods=["GET"])
 def keep_alive():
@@ -761,4 +954,5 @@ def keep_alive():
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5001))
+    space_pool.get_pool()  # bắt đầu warm-up ngay, không chờ request /ocr đầu tiên
     app.run(host="0.0.0.0", port=port)
@@ -0,0 +1,228 @@
+"""
+Lưu kết quả OCR để không phải upload + OCR lại cùng một ảnh.
+
+SQLite (chế độ WAL) với khóa là sha256 của ảnh:
+    image_hash → ocr_text → extraction (JSON kết quả Gemini gần nhất)
+
+- Đọc/ghi từ nhiều worker gunicorn cùng lúc (WAL cho phép đọc song song khi ghi)
+- Vượt OCR_STORE_MAX_MB thì xóa các ảnh lâu không dùng nhất (LRU) rồi compact
+- Mỗi lần gọi mở connection riêng → an toàn khi fork, không giữ state giữa request
+
+⚠️ OCR_STORE_PATH phải trỏ vào ổ bền (volume). Mặc định là file trong thư mục
+làm việc, chỉ hợp cho chạy local; trên Fly.io fly.toml mount volume "ocr_data"
+vào /data và đặt OCR_STORE_PATH=/data/ocr_store.db. Nơi không có volume
+(vd. gói free của Render) store vẫn chạy nhưng mất dữ liệu mỗi lần deploy.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+OCR_STORE_PATH = os.environ.get("OCR_STORE_PATH", "ocr_store.db")
+OCR_STORE_MAX_MB = float(os.environ.get("OCR_STORE_MAX_MB", 200))
+
+# Sau khi vượt ngưỡng thì xóa xuống còn tỉ lệ này để không phải evict liên tục
+EVICT_TARGET_RATIO = 0.8
+# Số dòng đọc mỗi lần khi duyệt cả store (re-extract hàng loạt)
+ITER_BATCH_SIZE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_results (
+    image_hash     TEXT PRIMARY KEY,
+    ocr_text       TEXT NOT NULL,
+    categories     TEXT,
+    extraction     TEXT,
+    prompt_version INTEGER,
+    created_at     REAL NOT NULL,
+    last_used_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_ocr_results_last_used ON ocr_results (last_used_at);
+CREATE INDEX IF NOT EXISTS idx_ocr_results_prompt_version ON ocr_results (prompt_version);
+"""
+
+
+def image_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _connect():
+    conn = sqlite3.connect(OCR_STORE_PATH, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def init_store():
+    """Tạo file DB + bảng nếu chưa có (gọi một lần khi import ocr.py)."""
+    directory = os.path.dirname(OCR_STORE_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with closing(_connect()) as conn:
+        # auto_vacuum phải đặt trước khi tạo bảng mới có hiệu lực
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+
+
+def get(image_hash):
+    """Trả về dict (ocr_text, categories, extraction, ...) hoặc None."""
+    with closing(_connect()) as conn, conn:
+        row = conn.execute(
+            "SELECT * FROM ocr_results WHERE image_hash = ?", (image_hash,)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE ocr_results SET last_used_at = ? WHERE image_hash = ?",
+            (time.time(), image_hash),
+        )
+    return _row_to_dict(row)
+
+
+def put_ocr(image_hash, ocr_text):
+    now = time.time()
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            """
+            INSERT INTO ocr_results (image_hash, ocr_text, created_at, last_used_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (image_hash) DO UPDATE SET
+                ocr_text = excluded.ocr_text,
+                last_used_at = excluded.last_used_at
+            """,
+            (image_hash, ocr_text, now, now),
+        )
+    evict_if_needed()
+
+
+def put_extraction(image_hash, categories, extraction, prompt_version):
+    with closing(_connect()) as conn, conn:
+        conn.execute(
+            """
+            UPDATE ocr_results
+            SET categories = ?, extraction = ?, prompt_version = ?, last_used_at = ?
+            WHERE image_hash = ?
+            """,
+            (
+                json.dumps(categories, ensure_ascii=False) if categories is not None else None,
+                json.dumps(extraction, ensure_ascii=False),
+                prompt_version,
+                time.time(),
+                image_hash,
+            ),
+        )
+
+
+def count_stale(prompt_version):
+    with closing(_connect()) as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM ocr_results WHERE prompt_version IS NULL OR prompt_version < ?",
+            (prompt_version,),
+        ).fetchone()[0]
+
+
+def iter_stale(prompt_version, limit=None, batch_size=ITER_BATCH_SIZE):
+    """
+    Các ảnh có kết quả trích xuất từ prompt cũ hơn prompt_version (hoặc chưa có),
+    dùng cho lệnh re-extract hàng loạt khi đổi prompt.
+
+    Generator đọc từng lô theo image_hash (keyset) → chỉ giữ batch_size dòng
+    trong RAM dù cả store cần migrate; ghi kết quả giữa các lô cũng không làm
+    lệch thứ tự duyệt.
+    """
+    last_hash = ""
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        with closing(_connect()) as conn:
+            rows = conn.execute(
+                """
+                SELECT * FROM ocr_results
+                WHERE (prompt_version IS NULL OR prompt_version < ?) AND image_hash > ?
+                ORDER BY image_hash
+                LIMIT ?
+                """,
+                (prompt_version, last_hash, size),
+            ).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield _row_to_dict(row)
+        last_hash = rows[-1]["image_hash"]
+        if remaining is not None:
+            remaining -= len(rows)
+
+
+def size_bytes():
+    """Dung lượng thực sự đang dùng (không tính trang trống chờ vacuum)."""
+    with closing(_connect()) as conn:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return (page_count - freelist) * page_size
+
+
+def evict_if_needed(max_mb=None):
+    """Xóa các ảnh ít dùng gần đây nhất cho tới khi DB dưới ngưỡng. Trả về số dòng đã xóa."""
+    max_bytes = (max_mb or OCR_STORE_MAX_MB) * 1024 * 1024
+    used = size_bytes()
+    if used <= max_bytes:
+        return 0
+
+    to_free = used - max_bytes * EVICT_TARGET_RATIO
+    evicted = []
+    with closing(_connect()) as conn, conn:
+        rows = conn.execute(
+            """
+            SELECT image_hash,
+                   length(ocr_text) + length(coalesce(categories, ''))
+                   + length(coalesce(extraction, '')) AS row_bytes
+            FROM ocr_results ORDER BY last_used_at ASC
+            """
+        )
+        for row in rows:
+            if to_free <= 0:
+                break
+            evicted.append((row["image_hash"],))
+            to_free -= row["row_bytes"]
+        conn.executemany("DELETE FROM ocr_results WHERE image_hash = ?", evicted)
+
+    print(f"🧹 OCR store vượt {max_bytes / 1024 / 1024:g} MB → xóa {len(evicted)} ảnh cũ")
+    compact()
+    return len(evicted)
+
+
+def compact(full=False):
+    """
+    Trả lại dung lượng trống cho hệ điều hành và gộp WAL vào file chính.
+    full=True chạy VACUUM (chép lại toàn bộ DB, khóa ghi trong lúc chạy).
+    """
+    with closing(_connect()) as conn:
+        if full:
+            conn.execute("VACUUM")
+        else:
+            # sqlite3 chỉ chạy pragma này một bước (một trang) mỗi lần execute;
+            # executescript chạy tới hết nên giải phóng toàn bộ freelist
+            conn.executescript("PRAGMA incremental_vacuum;")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def stats():
+    with closing(_connect()) as conn:
+        total = conn.execute("SELECT COUNT(*) FROM ocr_results").fetchone()[0]
+    return {
+        "path": OCR_STORE_PATH,
+        "images": total,
+        "size_mb": round(size_bytes() / 1024 / 1024, 2),
+        "max_mb": OCR_STORE_MAX_MB,
+    }
+
+
+def _row_to_dict(row):
+    record = dict(row)
+    for key in ("categories", "extraction"):
+        if record.get(key) is not None:
+            record[key] = json.loads(record[key])
+    return record
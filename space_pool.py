@@ -0,0 +1,377 @@
+"""
+Pool các Hugging Face Space OCR + luồng nền giữ Space luôn "ấm".
+
+- OCR_SPACES: danh sách Space (phân cách bằng dấu phẩy), ví dụ Space gốc và
+  các bản duplicate của nó. Mặc định chỉ có "hoangphuc05/ocr-invoice".
+- Mỗi request OCR được gửi tới replica khỏe có độ trễ (EWMA) thấp nhất,
+  có tính số request đang chờ; lỗi thì thử replica kế tiếp. Độ trễ chỉ đo
+  trên request thật; độ trễ warm-up (ảnh 1x1) tính riêng, chỉ dùng tạm cho
+  replica chưa có request thật nào.
+- Replica lỗi liên tiếp EJECT_AFTER_FAILURES lần bị loại tạm thời (backoff
+  tăng dần); luồng warm-up thử lại và đưa nó về pool khi gọi được.
+- Luồng warm-up gửi một ảnh 1x1 tới từng replica mỗi OCR_WARM_INTERVAL giây
+  để Space không bị ngủ → /ocr đầu tiên sau lúc rảnh không phải chờ cold start.
+
+Nhiều worker gunicorn dùng chung một trạng thái: độ trễ, lỗi, bị loại, số
+request đang chờ được ghi vào file JSON trong SHARED_STATE_DIR (khóa bằng
+flock), nên worker nào cũng định tuyến và báo /ocr/space-stats giống nhau.
+Mỗi worker có luồng warm-up, nhưng chỉ worker giữ được khóa "warmer" mới thực
+sự gửi warm-up; worker đó chết thì worker khác nhận khóa ở vòng sau.
+Client gradio không fork được nên vẫn tạo riêng trong từng worker.
+
+Không có fcntl (Windows, chỉ chạy `python ocr.py` một process): trạng thái
+giữ trong bộ nhớ sau threading.Lock và process đó luôn là warmer.
+"""
+import base64
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# ✅ fcntl chỉ có trên Unix; thiếu thì pool chạy một process, không chia sẻ trạng thái
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from gradio_client import Client, handle_file
+
+OCR_SPACES = [s.strip() for s in os.environ.get("OCR_SPACES", "hoangphuc05/ocr-invoice").split(",") if s.strip()]
+OCR_TIMEOUT = float(os.environ.get("OCR_TIMEOUT", 120))
+OCR_WARM_INTERVAL = float(os.environ.get("OCR_WARM_INTERVAL", 300))
+OCR_WARM_TIMEOUT = float(os.environ.get("OCR_WARM_TIMEOUT", 90))
+
+# Cùng thư mục trạng thái dùng chung với features.py
+SHARED_STATE_DIR = os.environ.get("SHARED_STATE_DIR", "/tmp/ocr-shared")
+STATE_PATH = os.path.join(SHARED_STATE_DIR, "ocr_spaces.json")
+STATE_LOCK_PATH = STATE_PATH + ".lock"
+WARMER_LOCK_PATH = os.path.join(SHARED_STATE_DIR, "ocr_spaces.warmer.lock")
+
+EJECT_AFTER_FAILURES = 3
+EJECT_BASE_SECONDS = 60
+EJECT_MAX_SECONDS = 15 * 60
+# Trọng số của lần đo mới nhất trong độ trễ trung bình (EWMA)
+LATENCY_ALPHA = 0.3
+
+# PNG trắng 1x1 — ảnh warm-up nhẹ nhất có thể
+WARM_IMAGE_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAAAAAA6fptVAAAACklEQVR4nGP4DwABAQEAWjvnWAAAAABJRU5ErkJggg=="
+)
+
+
+def _new_replica():
+    return {
+        "latency_ms": None,          # EWMA trên request thật
+        "last_latency_ms": None,
+        "warm_latency_ms": None,     # EWMA trên ảnh warm-up
+        "in_flight": {},             # pid → số request thật đang chờ replica này
+        "space_queue_size": None,    # hàng đợi phía Space, đọc từ job warm-up
+        "requests": 0,
+        "failures": 0,
+        "warm_requests": 0,
+        "warm_failures": 0,
+        "consecutive_failures": 0,
+        "ejected_until": 0.0,
+        "last_ok_at": None,
+        "last_warm_at": None,
+        "last_error": None,
+    }
+
+
+def _pid_alive(pid):
+    if fcntl is None:
+        # Chỉ có một process; os.kill(pid, 0) trên Windows lại là TerminateProcess
+        return int(pid) == os.getpid()
+    try:
+        os.kill(int(pid), 0)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def _in_flight(replica):
+    return sum(replica["in_flight"].values())
+
+
+def _score(replica):
+    # Chưa có request thật → tạm dùng độ trễ warm-up; chưa đo gì thì ưu tiên thử trước
+    latency = replica["latency_ms"]
+    if latency is None:
+        latency = replica["warm_latency_ms"] or 0.0
+    return latency * (1 + _in_flight(replica))
+
+
+def _ewma(previous, sample):
+    if previous is None:
+        return sample
+    return LATENCY_ALPHA * sample + (1 - LATENCY_ALPHA) * previous
+
+
+class SharedState:
+    """Trạng thái pool dùng chung giữa các process, lưu trong STATE_PATH."""
+
+    def __init__(self, spaces):
+        self.spaces = spaces
+        # Dùng khi không có fcntl: trạng thái chỉ trong process này
+        self.local = {}
+        self.local_lock = threading.Lock()
+
+    def read(self):
+        if fcntl is None:
+            with self.local_lock:
+                return self._fill(copy.deepcopy(self.local))
+        try:
+            with open(STATE_PATH) as fh:
+                state = json.load(fh)
+        except (OSError, ValueError):
+            state = {}
+        return self._fill(state)
+
+    def _fill(self, state):
+        state.setdefault("replicas", {})
+        state.setdefault("warmer", {"pid": None, "rounds": 0, "last_round_at": None})
+        for space in self.spaces:
+            replica = state["replicas"].setdefault(space, _new_replica())
+            # File trạng thái từ bản cũ có thể thiếu field mới
+            for key, value in _new_replica().items():
+                replica.setdefault(key, value)
+        return state
+
+    @contextmanager
+    def update(self):
+        """Đọc → sửa → ghi trạng thái dưới khóa flock (an toàn giữa process lẫn thread)."""
+        if fcntl is None:
+            with self.local_lock:
+                state = self._fill(self.local)
+                yield state
+                self._prune(state)
+            return
+
+        os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+        with open(STATE_LOCK_PATH, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = self.read()
+            yield state
+            self._prune(state)
+            tmp_path = f"{STATE_PATH}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as fh:
+                json.dump(state, fh)
+            os.replace(tmp_path, STATE_PATH)
+
+    @staticmethod
+    def _prune(state):
+        # Bỏ số request đang chờ của worker đã chết (bị kill giữa chừng)
+        for replica in state["replicas"].values():
+            replica["in_flight"] = {
+                pid: n for pid, n in replica["in_flight"].items() if n > 0 and _pid_alive(pid)
+            }
+
+
+class SpacePool:
+    def __init__(self, spaces):
+        self.spaces = spaces
+        self.state = SharedState(spaces)
+        self.clients = {}
+        self.warmer = None
+        self.warmer_lock = None
+
+        fd, self.warm_image_path = tempfile.mkstemp(prefix="ocr-warm-", suffix=".png")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(WARM_IMAGE_PNG)
+
+    # ---------- routing ----------
+
+    def _ranked(self):
+        """Replica khỏe theo thứ tự độ trễ tăng dần; nếu không còn ai khỏe thì thử replica sắp hết bị loại."""
+        now = time.time()
+        replicas = self.state.read()["replicas"]
+        healthy = [s for s in self.spaces if replicas[s]["ejected_until"] <= now]
+        if healthy:
+            return sorted(healthy, key=lambda s: _score(replicas[s]))
+        return sorted(self.spaces, key=lambda s: replicas[s]["ejected_until"])
+
+    def predict(self, image_path):
+        """OCR một ảnh qua replica tốt nhất, tự chuyển sang replica khác nếu lỗi."""
+        last_error = None
+        for space in self._ranked():
+            try:
+                return self._call(space, image_path, OCR_TIMEOUT)
+            except Exception as e:
+                last_error = e
+                print(f"⚠️ OCR Space {space} lỗi: {e} → thử replica khác")
+        raise RuntimeError(f"All OCR Spaces failed: {last_error}")
+
+    def _call(self, space, image_path, timeout, warm=False):
+        pid = str(os.getpid())
+        with self.state.update() as state:
+            replica = state["replicas"][space]
+            if warm:
+                replica["warm_requests"] += 1
+                replica["last_warm_at"] = time.time()
+            else:
+                replica["requests"] += 1
+                replica["in_flight"][pid] = replica["in_flight"].get(pid, 0) + 1
+
+        start = time.perf_counter()
+        job = None
+        queue_size = None
+        try:
+            if space not in self.clients:
+                self.clients[space] = Client(space)
+            job = self.clients[space].submit(handle_file(image_path), api_name="/predict")
+            result = job.result(timeout=timeout)
+            if warm:
+                queue_size = getattr(job.status(), "queue_size", None)
+        except Exception as e:
+            if job is not None and isinstance(e, TimeoutError):
+                # Rút job khỏi hàng đợi của Space thay vì để nó chạy cho không ai nhận
+                job.cancel()
+            self._record_failure(space, pid, e, warm)
+            raise
+        else:
+            self._record_success(space, pid, (time.perf_counter() - start) * 1000, warm, queue_size)
+            return result
+
+    def _record_success(self, space, pid, latency_ms, warm, queue_size):
+        with self.state.update() as state:
+            replica = state["replicas"][space]
+            if warm:
+                replica["warm_latency_ms"] = _ewma(replica["warm_latency_ms"], latency_ms)
+                replica["space_queue_size"] = queue_size
+            else:
+                replica["in_flight"][pid] = replica["in_flight"].get(pid, 0) - 1
+                replica["latency_ms"] = _ewma(replica["latency_ms"], latency_ms)
+                replica["last_latency_ms"] = latency_ms
+            # Warm-up thành công cũng đủ để đưa replica về pool
+            replica["consecutive_failures"] = 0
+            replica["ejected_until"] = 0.0
+            replica["last_ok_at"] = time.time()
+            replica["last_error"] = None
+
+    def _record_failure(self, space, pid, error, warm):
+        with self.state.update() as state:
+            replica = state["replicas"][space]
+            if warm:
+                replica["warm_failures"] += 1
+            else:
+                replica["in_flight"][pid] = replica["in_flight"].get(pid, 0) - 1
+                replica["failures"] += 1
+            replica["consecutive_failures"] += 1
+            replica["last_error"] = str(error) or type(error).__name__
+            failures = replica["consecutive_failures"]
+            if failures >= EJECT_AFTER_FAILURES:
+                # Bị loại lâu dần: 60s, 120s, 240s... tối đa 15 phút
+                backoff = min(EJECT_BASE_SECONDS * 2 ** (failures - EJECT_AFTER_FAILURES), EJECT_MAX_SECONDS)
+                replica["ejected_until"] = time.time() + backoff
+
+        if failures >= EJECT_AFTER_FAILURES:
+            # Client có thể đang hỏng (mất kết nối, Space restart) → tạo lại khi dùng lần sau
+            self.clients.pop(space, None)
+            print(f"🚫 OCR Space {space} bị loại {backoff}s sau {failures} lỗi liên tiếp")
+
+    # ---------- warm-up ----------
+
+    def warm_once(self):
+        """Gửi ảnh warm-up tới từng replica (kể cả replica đang bị loại, để thử đưa về pool)."""
+        for space in self.spaces:
+            try:
+                self._call(space, self.warm_image_path, OCR_WARM_TIMEOUT, warm=True)
+            except Exception as e:
+                print(f"🥶 Warm-up {space} thất bại: {e}")
+        with self.state.update() as state:
+            state["warmer"]["rounds"] += 1
+            state["warmer"]["last_round_at"] = time.time()
+
+    def _is_warmer(self):
+        """Chỉ một process (giữ flock WARMER_LOCK_PATH) được gửi warm-up."""
+        if self.warmer_lock is not None:
+            return True
+        if fcntl is None:
+            # Không chia sẻ trạng thái → process duy nhất tự làm warmer
+            self.warmer_lock = True
+        else:
+            os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+            lock = open(WARMER_LOCK_PATH, "a")
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+                return False
+            # Giữ file mở tới khi process kết thúc; process chết thì kernel tự nhả khóa
+            self.warmer_lock = lock
+        with self.state.update() as state:
+            state["warmer"]["pid"] = os.getpid()
+        print(f"🔥 Worker {os.getpid()} nhận nhiệm vụ warm-up OCR Space")
+        return True
+
+    def _warm_loop(self):
+        while True:
+            if self._is_warmer():
+                self.warm_once()
+            time.sleep(OCR_WARM_INTERVAL)
+
+    def start_warmer(self):
+        if OCR_WARM_INTERVAL <= 0 or (self.warmer and self.warmer.is_alive()):
+            return
+        self.warmer = threading.Thread(target=self._warm_loop, name="ocr-space-warmer", daemon=True)
+        self.warmer.start()
+
+    def stats(self):
+        now = time.time()
+        state = self.state.read()
+        replicas = []
+        for space in self.spaces:
+            r = state["replicas"][space]
+            in_flight = sum(n for pid, n in r["in_flight"].items() if _pid_alive(pid))
+            replicas.append({
+                "space": space,
+                "healthy": r["ejected_until"] <= now,
+                "warm": r["last_ok_at"] is not None and now - r["last_ok_at"] < OCR_WARM_INTERVAL * 1.5,
+                "ejected_for_s": round(max(0.0, r["ejected_until"] - now), 1),
+                "latency_ms": round(r["latency_ms"], 1) if r["latency_ms"] is not None else None,
+                "last_latency_ms": round(r["last_latency_ms"], 1) if r["last_latency_ms"] is not None else None,
+                "warm_latency_ms": round(r["warm_latency_ms"], 1) if r["warm_latency_ms"] is not None else None,
+                "in_flight": in_flight,
+                "space_queue_size": r["space_queue_size"],
+                "requests": r["requests"],
+                "failures": r["failures"],
+                "warm_requests": r["warm_requests"],
+                "warm_failures": r["warm_failures"],
+                "consecutive_failures": r["consecutive_failures"],
+                "last_ok_s_ago": round(now - r["last_ok_at"], 1) if r["last_ok_at"] else None,
+                "last_warm_s_ago": round(now - r["last_warm_at"], 1) if r["last_warm_at"] else None,
+                "last_error": r["last_error"],
+            })
+
+        warmer = state["warmer"]
+        return {
+            "replicas": replicas,
+            "healthy": sum(r["healthy"] for r in replicas),
+            "queue_depth": sum(r["in_flight"] for r in replicas),
+            "warm_interval_s": OCR_WARM_INTERVAL,
+            "warm_rounds": warmer["rounds"],
+            "warmer_pid": warmer["pid"],
+            "warmer_running": warmer["pid"] is not None and _pid_alive(warmer["pid"]),
+            "last_warm_round_s_ago": round(now - warmer["last_round_at"], 1) if warmer["last_round_at"] else None,
+            "served_by": os.getpid(),
+        }
+
+
+_pool = None
+_pool_pid = None
+
+
+def get_pool():
+    """
+    Pool của process hiện tại. Thread và client gradio không sống sót qua fork,
+    nên mỗi worker gunicorn tự tạo pool (trạng thái thì dùng chung qua file).
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = SpacePool(OCR_SPACES)
+        _pool_pid = os.getpid()
+        _pool.start_warmer()
+    return _pool